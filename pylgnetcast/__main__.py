@@ -3,13 +3,78 @@ Simple command line tool to control a LG NetCast TV.
 """
 import argparse
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import sys
-from xml.etree import ElementTree
 
-from . pylgnetcast import LgNetCastClient, AccessTokenError, LG_QUERY
+from . pylgnetcast import (LgNetCastClient, AsyncLgNetCastClient,
+                           AccessTokenError, LG_QUERY, element_to_string)
 
 _LOGGER = logging.getLogger(__name__)
 
+INFOS = {'Channel Info': LG_QUERY.CUR_CHANNEL,
+         'Volume Info': LG_QUERY.VOLUME_INFO,
+         'Context Info': LG_QUERY.CONTEXT_UI,
+         'Is 3D': LG_QUERY.IS_3D}
+
+
+def _query_first(client, query):
+    """Return the first data element of a TV query or None."""
+    data = client.query_data(query)
+    return next(data, None) if data else None
+
+
+async def _async_query_first(client, query):
+    """Return the first data element of a TV query or None."""
+    data = await client.query_data(query)
+    return next(data, None) if data else None
+
+
+def _print_infos(results):
+    """Print the first data element or the error of each status query."""
+    for title, data in zip(INFOS, results):
+        if isinstance(data, Exception):
+            print('Can not retrieve %s - error: %s' % (title.lower(), data))
+        elif data is not None:
+            print('%s: %s' % (title, element_to_string(data)))
+
+
+def _run(args):
+    """Send the command and query the TV status with the blocking client."""
+    with LgNetCastClient(args.host, args.pairing_key,
+                         args.protocol) as client:
+        if args.command:
+            client.send_command(args.command)
+            print('Sent command %s' % args.command)
+
+        with ThreadPoolExecutor(max_workers=len(INFOS)) as executor:
+            futures = [executor.submit(_query_first, client, query)
+                       for query in INFOS.values()]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as error:
+                results.append(error)
+        _print_infos(results)
+
+
+async def _run_async(args, asyncio):
+    """Send the command and query the TV status with the asyncio client.
+
+    The asyncio module is passed in by main, which imports it only when the
+    asyncio client is requested.
+    """
+    async with AsyncLgNetCastClient(args.host, args.pairing_key,
+                                    args.protocol) as client:
+        if args.command:
+            await client.send_command(args.command)
+            print('Sent command %s' % args.command)
+
+        results = await asyncio.gather(
+            *(_async_query_first(client, query) for query in INFOS.values()),
+            return_exceptions=True)
+        _print_infos(results)
+
 
 def main():
     """Process command line and send commands to TV."""
@@ -24,6 +89,9 @@ def main():
                         help='LG TV protocol hdcp or roap')
     parser.add_argument('--command', metavar='command', type=int,
                         help='Remote control command to send to the TV')
+    parser.add_argument('--async', dest='use_async', action='store_const',
+                        const=True, default=False,
+                        help='use the asyncio client (requires aiohttp)')
     parser.add_argument('--verbose', dest='verbose', action='store_const',
                         const=True, default=False,
                         help='debug output')
@@ -33,25 +101,11 @@ def main():
         logging.basicConfig(level=logging.DEBUG)
 
     try:
-        with LgNetCastClient(args.host, args.pairing_key,
-                             args.protocol) as client:
-            if args.command:
-                client.send_command(args.command)
-                print('Sent command %s' % args.command)
-
-            infos = {'Channel Info': LG_QUERY.CUR_CHANNEL,
-                     'Volume Info': LG_QUERY.VOLUME_INFO,
-                     'Context Info': LG_QUERY.CONTEXT_UI,
-                     'Is 3D': LG_QUERY.IS_3D}
-            for title, query in infos.items():
-                try:
-                    data = client.query_data(query)
-                    if data:
-                        print('%s: %s' %
-                              (title, ElementTree.tostring(data[0],
-                                                           encoding='unicode')))
-                except Exception as error:
-                    'Can not retrieve %s - error: %s' % (title.lower(), error)
+        if args.use_async:
+            import asyncio
+            asyncio.run(_run_async(args, asyncio))
+        else:
+            _run(args)
     except AccessTokenError:
         print('Access token is displayed on TV - '
               'use it for the --pairing_key parameter to connect to your TV.')
@@ -8,14 +8,22 @@ For pre 2012 LG TV remote commands are supported by the "hdcp" protocol.
 The client is inspired by the work of
 https://github.com/ubaransel/lgcommander
 """
+import hashlib
+from enum import IntEnum
+import io
+import json
 import logging
-import requests
-from xml.etree import ElementTree
+import os
+import re
+import threading
+import time
+from http import HTTPStatus
 
 _LOGGER = logging.getLogger(__name__)
 
-__all__ = ['LgNetCastClient', 'LG_COMMAND', 'LG_QUERY', 'LgNetCastError',
-           'AccessTokenError', 'SessionIdError']
+__all__ = ['LgNetCastClient', 'AsyncLgNetCastClient', 'LG_COMMAND',
+           'LG_QUERY', 'LgNetCastError', 'AccessTokenError', 'SessionIdError',
+           'element_to_string']
 
 
 # LG TV handler
@@ -28,8 +36,40 @@ LG_HANDLE_CHANNEL_CHANGE = 'HandleChannelChange'
 DEFAULT_PORT = 8080
 DEFAULT_TIMEOUT = 3
 
+SESSION_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache',
+                                  'pylgnetcast', 'sessions.json')
+SESSION_CACHE_TTL = 3600
 
-class LG_COMMAND(object):
+_SESSION_CACHE_LOCK = threading.Lock()
+
+_SESSION_RE = re.compile(rb'<session>\s*([^<\s]+)\s*</session>')
+
+# The XML library is imported on first use by _import_element_tree.
+ElementTree = None
+_PARSER_OPTIONS = {}
+
+
+def _import_element_tree():
+    """Import the XML library on first use, preferring lxml."""
+    global ElementTree, _PARSER_OPTIONS
+    if ElementTree is None:
+        try:
+            from lxml import etree
+            # TV responses need neither entity expansion nor network access.
+            _PARSER_OPTIONS = {'resolve_entities': False, 'no_network': True,
+                               'huge_tree': False}
+        except ImportError:
+            from xml.etree import ElementTree as etree
+        ElementTree = etree
+    return ElementTree
+
+
+def element_to_string(element):
+    """Serialize a data element returned by query_data to a string."""
+    return _import_element_tree().tostring(element, encoding='unicode')
+
+
+class LG_COMMAND(IntEnum):
     """LG TV remote control commands."""
     POWER = 1
     NUMBER_0 = 2
@@ -113,92 +153,420 @@ class LG_PROTOCOL(object):
     ROAP = 'roap'
 
 
-class LgNetCastClient(object):
-    """LG NetCast TV client using the ROAP or HDCP protocol."""
+class _LgNetCastClientBase(object):
+    """Protocol handling shared by the blocking and the asyncio client."""
 
     HEADER = {'Content-Type': 'application/atom+xml'}
     XML = '<?xml version=\"1.0\" encoding=\"utf-8\"?>'
     KEY = XML + '<auth><type>AuthKeyReq</type></auth>'
     AUTH = XML + '<auth><type>%s</type><value>%s</value></auth>'
     COMMAND = XML + '<command><session>%s</session><type>%s</type>%s</command>'
+    _KEY_BYTES = KEY.encode('utf-8')
+    _CMD_SUFFIX = '</value></command>'
 
-    def __init__(self, host, access_token, protocol=LG_PROTOCOL.ROAP):
-        """Initialize the LG TV client."""
+    def __init__(self, host, access_token, protocol=LG_PROTOCOL.ROAP,
+                 session_cache=SESSION_CACHE_FILE):
+        """Initialize the LG TV client.
+
+        Session ids are cached in the session_cache file to skip the
+        authentication on the next connection, set it to None to disable
+        the cache.
+        """
         self.url = 'http://%s:%s/%s/api/' % (host, DEFAULT_PORT, protocol)
         self.access_token = access_token
         self.protocol = protocol
+        self._urls = {message_type: '%s%s' % (self.url, message_type)
+                      for message_type in ('auth', 'command', 'data')}
+        if protocol == LG_PROTOCOL.HDCP:
+            self._urls['auth'] = self._urls['data'] = (
+                '%sdtv_wifirc' % self.url)
+        self.session_cache = session_cache
+        self._cache_key = hashlib.sha256(
+            ('%s|%s' % (host, access_token)).encode('utf-8')).hexdigest()
         self._session = None
+        self._cmd_prefix = None
+        self._http = None
+
+    @staticmethod
+    def _serialize_channel(channel):
+        """Serialize a channel element unless it is already a string."""
+        if isinstance(channel, str):
+            return channel
+        return element_to_string(channel)
+
+    def _set_session(self, session):
+        """Set the session id and the command prefix bound to it."""
+        self._session = session
+        self._cmd_prefix = (
+            f'{self.XML}<command><session>{session}</session>'
+            f'<type>{LG_HANDLE_KEY_INPUT}</type><value>')
+
+    def _key_input_message(self, command):
+        """Build the message for a remote control command."""
+        return f'{self._cmd_prefix}{command}{self._CMD_SUFFIX}'
+
+    def _command_message(self, handler, value):
+        """Build the message for a command of the given handler."""
+        return self.COMMAND % (self._session, handler, value)
+
+    def _parse_session_id(self, data):
+        """Extract the session id from the auth response."""
+        match = _SESSION_RE.search(data)
+        if match:
+            session = match.group(1).decode('ascii')
+        else:
+            etree = _import_element_tree()
+            tree = etree.fromstring(data, etree.XMLParser(**_PARSER_OPTIONS))
+            session = tree.find('session').text
+        return session
+
+    def _load_session_id(self):
+        """Return the cached session id if it has not expired."""
+        if not self.session_cache:
+            return None
+        entry = _read_session_cache(self.session_cache).get(self._cache_key)
+        if entry and time.time() - entry['time'] < SESSION_CACHE_TTL:
+            return entry['session']
+        return None
+
+    def _store_session_id(self, session):
+        """Store the session id in the cache or drop it if None."""
+        if not self.session_cache:
+            return
+        with _SESSION_CACHE_LOCK:
+            now = time.time()
+            sessions = {key: entry for key, entry
+                        in _read_session_cache(self.session_cache).items()
+                        if now - entry['time'] < SESSION_CACHE_TTL}
+            if session:
+                sessions[self._cache_key] = {'session': session, 'time': now}
+            else:
+                sessions.pop(self._cache_key, None)
+            _write_session_cache(self.session_cache, sessions)
+
+
+class LgNetCastClient(_LgNetCastClientBase):
+    """LG NetCast TV client using the ROAP or HDCP protocol."""
+
+    def __init__(self, host, access_token, protocol=LG_PROTOCOL.ROAP,
+                 session_cache=SESSION_CACHE_FILE):
+        """Initialize the LG TV client."""
+        super().__init__(host, access_token, protocol, session_cache)
+        self._http_lock = threading.Lock()
 
     def __enter__(self):
         """Context manager method to support with statement."""
-        self._session = self._get_session_id()
+        try:
+            self._set_session(self._get_session_id())
+        except BaseException:
+            self._close_http()
+            raise
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """Context manager method to support with statement."""
-        self._session = None
+        self._set_session(None)
+        self._close_http()
 
     def send_command(self, command):
         """Send remote control commands to the TV."""
-        message = self.COMMAND % (self._session, LG_HANDLE_KEY_INPUT,
-                                  '<value>%s</value>' % command)
-        self._send_to_tv('command', message)
+        self._send_command(self._key_input_message, command)
+
+    def send_commands(self, commands):
+        """Send a sequence of remote control commands to the TV in order.
+
+        The commands share the kept alive connection to the TV, the ROAP
+        API accepts only one command per request.
+        """
+        for command in commands:
+            self._send_command(self._key_input_message, command)
 
     def change_channel(self, channel):
-        """Send change channel command to the TV."""
-        message = self.COMMAND % (self._session, LG_HANDLE_CHANNEL_CHANGE,
-                                  ElementTree.tostring(channel,
-                                                       encoding='unicode'))
-        self._send_to_tv('command', message)
-
-    def query_data(self, query):
-        """Query status information from the TV."""
-        response = self._send_to_tv('data', payload={'target': query})
-        if response.status_code == requests.codes.ok:
-            data = response.text
-            tree = ElementTree.XML(data)
-            data_list = []
-            for data in tree.iter('data'):
-                data_list.append(data)
-            return data_list
-
-    def _get_session_id(self):
+        """Send change channel command to the TV.
+
+        The channel is either a data element of the channel list or its
+        already serialized XML string.
+        """
+        self._send_command(self._command_message, LG_HANDLE_CHANNEL_CHANGE,
+                           self._serialize_channel(channel))
+
+    def query_data(self, query, as_list=False):
+        """Query status information from the TV.
+
+        Returns a generator yielding the data elements of the response while
+        it is parsed or a list of all data elements if as_list is set.
+        """
+        response = self._send_to_tv('data', payload={'target': query},
+                                    stream=True)
+        if response.status_code == HTTPStatus.OK:
+            data = self._iter_data(response)
+            return list(data) if as_list else data
+        response.close()
+
+    @staticmethod
+    def _iter_data(response):
+        """Incrementally parse a streamed response and yield data elements."""
+        try:
+            response.raw.decode_content = True
+            yield from _iter_data_elements(response.raw)
+        finally:
+            response.close()
+
+    def _send_command(self, build_message, *args):
+        """Send a command to the TV, renewing a rejected session once."""
+        try:
+            self._send_to_tv('command', build_message(*args))
+        except SessionIdError:
+            _LOGGER.debug('Session id rejected by TV, requesting a new one.')
+            self._store_session_id(None)
+            self._set_session(self._get_session_id(use_cache=False))
+            self._send_to_tv('command', build_message(*args))
+
+    def _get_session_id(self, use_cache=True):
         """Get the session key for the TV connection.
 
         If a pair key is defined the session id is requested otherwise display
-        the pair key on TV.
+        the pair key on TV. A cached session id is used if available.
         """
         if not self.access_token:
             self._display_pair_key()
             raise AccessTokenError(
                 'No access token specified to create session.')
+        if use_cache:
+            session = self._load_session_id()
+            if session:
+                return session
         message = self.AUTH % ('AuthReq', self.access_token)
         response = self._send_to_tv('auth', message)
-        if response.status_code != requests.codes.ok:
+        if response.status_code != HTTPStatus.OK:
             raise SessionIdError('Can not get session id from TV.')
-        data = response.text
-        tree = ElementTree.XML(data)
-        session = tree.find('session').text
+        session = self._parse_session_id(response.content)
+        self._store_session_id(session)
         return session
 
     def _display_pair_key(self):
         """Send message to display the pair key on TV screen."""
-        self._send_to_tv('auth', self.KEY)
+        self._send_to_tv('auth', self._KEY_BYTES)
+
+    def _get_http(self):
+        """Return the pooled HTTP session, importing requests on first use.
 
-    def _send_to_tv(self, message_type, message=None, payload=None):
+        The session is created under a lock since queries may run in threads.
+        """
+        with self._http_lock:
+            if self._http is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                http = requests.Session()
+                http.headers.update(self.HEADER)
+                http.mount('http://', HTTPAdapter(pool_connections=1,
+                                                  pool_maxsize=4))
+                self._http = http
+            return self._http
+
+    def _close_http(self):
+        """Close the pooled HTTP session if it was created."""
+        with self._http_lock:
+            if self._http is not None:
+                self._http.close()
+                self._http = None
+
+    def _send_to_tv(self, message_type, message=None, payload=None,
+                    stream=False):
         """Send message of given type to the tv."""
-        if message_type != 'command' and self.protocol == LG_PROTOCOL.HDCP:
-            message_type = 'dtv_wifirc'
-        url = '%s%s' % (self.url, message_type)
+        url = self._urls[message_type]
         if message:
-            response = requests.post(url, data=message, headers=self.HEADER,
-                                     timeout=DEFAULT_TIMEOUT)
+            response = self._get_http().post(url, data=message,
+                                             timeout=DEFAULT_TIMEOUT)
         else:
-            response = requests.get(url, params=payload, headers=self.HEADER,
-                                    timeout=DEFAULT_TIMEOUT)
+            response = self._get_http().get(url, params=payload,
+                                            timeout=DEFAULT_TIMEOUT,
+                                            stream=stream)
+        if (message_type == 'command' and
+                response.status_code == HTTPStatus.UNAUTHORIZED):
+            raise SessionIdError('Session id rejected by TV.')
         return response
 
 
+class AsyncLgNetCastClient(_LgNetCastClientBase):
+    """LG NetCast TV client for asyncio, requires the aiohttp package."""
+
+    async def __aenter__(self):
+        """Context manager method to support async with statement."""
+        try:
+            self._set_session(await self._get_session_id())
+        except BaseException:
+            await self._close_http()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """Context manager method to support async with statement."""
+        self._set_session(None)
+        await self._close_http()
+
+    async def send_command(self, command):
+        """Send remote control commands to the TV."""
+        await self._send_command(self._key_input_message, command)
+
+    async def send_commands(self, commands):
+        """Send a sequence of remote control commands to the TV in order."""
+        for command in commands:
+            await self._send_command(self._key_input_message, command)
+
+    async def change_channel(self, channel):
+        """Send change channel command to the TV.
+
+        The channel is either a data element of the channel list or its
+        already serialized XML string.
+        """
+        await self._send_command(self._command_message,
+                                 LG_HANDLE_CHANNEL_CHANGE,
+                                 self._serialize_channel(channel))
+
+    async def query_data(self, query, as_list=False):
+        """Query status information from the TV.
+
+        The response is read completely, the returned generator or list
+        yields the data elements like LgNetCastClient.query_data.
+        """
+        status, content = await self._send_to_tv('data',
+                                                 payload={'target': query})
+        if status == HTTPStatus.OK:
+            data = _iter_data_elements(io.BytesIO(content))
+            return list(data) if as_list else data
+
+    async def _send_command(self, build_message, *args):
+        """Send a command to the TV, renewing a rejected session once."""
+        try:
+            await self._send_to_tv('command', build_message(*args))
+        except SessionIdError:
+            _LOGGER.debug('Session id rejected by TV, requesting a new one.')
+            await self._run_blocking(self._store_session_id, None)
+            self._set_session(await self._get_session_id(use_cache=False))
+            await self._send_to_tv('command', build_message(*args))
+
+    async def _get_session_id(self, use_cache=True):
+        """Get the session key for the TV connection."""
+        if not self.access_token:
+            await self._display_pair_key()
+            raise AccessTokenError(
+                'No access token specified to create session.')
+        if use_cache:
+            session = await self._run_blocking(self._load_session_id)
+            if session:
+                return session
+        message = self.AUTH % ('AuthReq', self.access_token)
+        status, content = await self._send_to_tv('auth', message)
+        if status != HTTPStatus.OK:
+            raise SessionIdError('Can not get session id from TV.')
+        session = self._parse_session_id(content)
+        await self._run_blocking(self._store_session_id, session)
+        return session
+
+    async def _run_blocking(self, func, *args):
+        """Run blocking session cache file I/O outside of the event loop."""
+        if not self.session_cache:
+            return func(*args)
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    async def _display_pair_key(self):
+        """Send message to display the pair key on TV screen."""
+        await self._send_to_tv('auth', self._KEY_BYTES)
+
+    def _get_http(self):
+        """Return the kept alive HTTP session, importing aiohttp first."""
+        if self._http is None:
+            import aiohttp
+            self._http = aiohttp.ClientSession(
+                headers=self.HEADER,
+                connector=aiohttp.TCPConnector(limit=4),
+                timeout=aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT))
+        return self._http
+
+    async def _close_http(self):
+        """Close the kept alive HTTP session if it was created."""
+        if self._http is not None:
+            http, self._http = self._http, None
+            await http.close()
+
+    async def _send_to_tv(self, message_type, message=None, payload=None):
+        """Send message of given type to the tv.
+
+        Returns the status code and the content of the response.
+        """
+        url = self._urls[message_type]
+        if message:
+            request = self._get_http().post(url, data=message)
+        else:
+            request = self._get_http().get(url, params=payload)
+        async with request as response:
+            if (message_type == 'command' and
+                    response.status == HTTPStatus.UNAUTHORIZED):
+                raise SessionIdError('Session id rejected by TV.')
+            return response.status, await response.read()
+
+
+def _iter_data_elements(source):
+    """Incrementally parse a TV response and yield its data elements.
+
+    Only data elements which are direct children of the root are yielded.
+    Every child is detached from the root once parsed so memory stays flat
+    for large responses like the channel list.
+    """
+    root = None
+    depth = 0
+    etree = _import_element_tree()
+    for event, elem in etree.iterparse(source, events=('start', 'end'),
+                                       **_PARSER_OPTIONS):
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            if elem.tag == 'data':
+                yield elem
+            root.remove(elem)
+
+
+def _read_session_cache(path):
+    """Read the cached session ids, an unreadable cache is empty."""
+    try:
+        with open(path, encoding='utf-8') as cache_file:
+            sessions = json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(sessions, dict):
+        return {}
+    return {key: entry for key, entry in sessions.items()
+            if isinstance(entry, dict) and 'session' in entry and
+            isinstance(entry.get('time'), (int, float))}
+
+
+def _write_session_cache(path, sessions):
+    """Atomically replace the session cache file."""
+    import tempfile
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as cache_file:
+            json.dump(sessions, cache_file)
+        os.replace(tmp_path, path)
+    except OSError as error:
+        _LOGGER.debug('Can not write session cache %s: %s', path, error)
+        if tmp_path:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+
 class LgNetCastError(Exception):
     """Base class for all exceptions in this module."""
 
@@ -2,10 +2,12 @@
 from setuptools import setup
 
 setup(name='pylgnetcast',
-            version='0.3.1',
+            version='0.4.0',
             description='Client for the LG Smart TV running NetCast 3 or 4.',
             url='https://github.com/wokar/pylgnetcast',
             license='MIT',
             packages=['pylgnetcast'],
-            install_requires=[],
+            python_requires='>=3.7',
+            install_requires=['requests'],
+            extras_require={'lxml': ['lxml'], 'async': ['aiohttp']},
             zip_safe=False)
\ No newline at end of file